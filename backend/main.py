@@ -1,18 +1,29 @@
-from fastapi import FastAPI, UploadFile, File
+from fastapi import FastAPI, UploadFile, File, Body, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from pathlib import Path
+from contextlib import asynccontextmanager
 import shutil
+import time
 import os
 import logging
 
 from models.predictor import predict, find_matching_items
+from models.catalog_shards import match_shard, sharding_enabled, start_shard_pools, shutdown_shard_pools
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("fitcheck")
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if sharding_enabled():
+        start_shard_pools()
+    yield
+    shutdown_shard_pools()
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "http://localhost:5173",
@@ -58,7 +69,8 @@ async def predict_route(file: UploadFile = File(...)):
         logger.info("predict() returned true tags: %s", true_tags)
         logger.debug("predict debug: %s", predict_debug)
 
-        matches, match_debug = find_matching_items(tags)
+        # The sharded path blocks while it gathers shard results; keep it off the event loop.
+        matches, match_debug = await run_in_threadpool(find_matching_items, tags)
 
         payload = {
             "tags": tags,
@@ -75,3 +87,35 @@ async def predict_route(file: UploadFile = File(...)):
         logger.exception("Error in /predict")
         return JSONResponse(content={"error": str(e), "debug": {"saved_path": str(saved_path)}}, status_code=500)
 
+
+@app.post("/shard/match")
+def shard_match_route(payload: dict = Body(...)):
+    # Worker side of the sharded matcher: scores this node's own catalog.
+    # Plain def so FastAPI runs the blocking scan in its threadpool.
+    wanted = payload.get("wanted", [])
+    if not isinstance(wanted, list) or not all(isinstance(w, str) for w in wanted):
+        raise HTTPException(status_code=400, detail="wanted must be a list of tag strings")
+    try:
+        k = int(payload.get("k", 5))
+        timeout = payload.get("timeout")
+        timeout = float(timeout) if timeout is not None else None
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="k must be an int and timeout a number")
+    if k < 0 or (timeout is not None and timeout < 0):
+        raise HTTPException(status_code=400, detail="k and timeout must not be negative")
+    shuffle_ties = payload.get("shuffle_ties", True)
+    if not isinstance(shuffle_ties, bool):
+        raise HTTPException(status_code=400, detail="shuffle_ties must be a boolean")
+    try:
+        result = match_shard(
+            str(LABELS_DIR),
+            str(CLOTHES_DIR),
+            wanted,
+            k=k,
+            shuffle_ties=shuffle_ties,
+            deadline=time.time() + timeout if timeout is not None else None,
+        )
+        return JSONResponse(content=result)
+    except Exception as e:
+        logger.exception("Error in /shard/match")
+        return JSONResponse(content={"error": str(e)}, status_code=500)
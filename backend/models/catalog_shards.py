@@ -0,0 +1,338 @@
+import os
+import json
+import heapq
+import random
+import time
+import threading
+import logging
+import multiprocessing
+from pathlib import Path, PurePosixPath
+from typing import Tuple, Dict, List, Optional
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Kept free of torch/CLIP imports so spawned shard workers start quickly.
+
+IMAGE_EXTS = (".webp", ".png", ".jpg", ".jpeg")
+
+# Comma-separated shard specs, one per shard. Each entry is one of:
+#   <labels_dir>                 images are read from the parent of labels_dir
+#                                (the same layout as Clothes/ and Clothes/labels/)
+#   <labels_dir>|<clothes_dir>   images are read from clothes_dir
+#   http(s)://host:port          a node running the FastAPI app; its /shard/match
+#                                route scans that node's own catalog
+# Local clothes dirs must sit inside the coordinator's CLOTHES_DIR so /static can
+# serve them; remote matches come back as absolute URLs on the remote node.
+SHARD_SPECS = [s.strip() for s in os.environ.get("FITCHECK_SHARDS", "").split(",") if s.strip()]
+SHARD_TIMEOUT = float(os.environ.get("FITCHECK_SHARD_TIMEOUT", "2.0") or 2.0)
+# Shards stop scanning this long before the coordinator's deadline so their
+# partial top-k still gets back in time (capped at a quarter of the timeout).
+SHARD_RETURN_MARGIN = float(os.environ.get("FITCHECK_SHARD_RETURN_MARGIN", "0.1") or 0.1)
+# A shard that already has this many calls running is skipped instead of queued.
+SHARD_MAX_INFLIGHT = max(1, int(os.environ.get("FITCHECK_SHARD_MAX_INFLIGHT", "2") or 2))
+
+_POOL_LOCK = threading.RLock()
+_PROCESS_POOL = None
+_THREAD_POOL = None
+_POOL_SPECS = None
+_INFLIGHT = {}
+
+
+def truthy(v):
+    if isinstance(v, bool):
+        return v
+    if v is None:
+        return False
+    if isinstance(v, (int, float)):
+        return bool(v)
+    s = str(v).strip().lower()
+    return s in ("true", "1", "yes", "y", "t")
+
+
+def sharding_enabled() -> bool:
+    return bool(SHARD_SPECS)
+
+
+def _is_remote(spec: str) -> bool:
+    return spec.startswith(("http://", "https://"))
+
+
+def parse_shard_spec(spec: str) -> Tuple[Path, Path]:
+    labels_dir, _, clothes_dir = spec.partition("|")
+    labels_dir = Path(labels_dir.strip())
+    clothes_dir = Path(clothes_dir.strip()) if clothes_dir.strip() else labels_dir.parent
+    return labels_dir, clothes_dir
+
+
+def _rank_key(score: int, base: str, shuffle_ties: bool):
+    # Smaller sorts first. Shards and the coordinator must use the same key so
+    # that the merged top-k equals the top-k of an unsharded scan.
+    return (-score, random.random() if shuffle_ties else base)
+
+
+def match_shard(labels_dir: str, clothes_dir: str, wanted: List[str], k: int = 5,
+                shuffle_ties: bool = True, deadline: Optional[float] = None) -> Dict:
+    """Scores one shard's catalog and returns its local top-k.
+
+    deadline is an absolute time.time() value. A scan that reaches it stops
+    early and returns the top-k it has so far with "timed_out" set.
+    """
+    labels_dir = Path(labels_dir)
+    clothes_dir = Path(clothes_dir)
+    wanted = set(wanted)
+    k = max(1, int(k or 5))
+    out = {"labels_checked": 0, "missing_images": [], "sample_label_flags": [],
+           "candidates": [], "timed_out": False}
+
+    if not labels_dir.exists():
+        out["error"] = f"labels dir missing: {labels_dir}"
+        return out
+
+    def scored():
+        for file in os.listdir(labels_dir):
+            if deadline is not None and time.time() >= deadline:
+                out["timed_out"] = True
+                return
+            if not file.lower().endswith(".json"):
+                continue
+            out["labels_checked"] += 1
+            try:
+                with open(labels_dir / file, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except Exception:
+                continue
+
+            raw_flags = data.get("flags", {}) if isinstance(data, dict) else {}
+            label_true_flags = {kk for kk, v in raw_flags.items() if truthy(v)}
+
+            if len(out["sample_label_flags"]) < 12:
+                out["sample_label_flags"].append({
+                    "file": file,
+                    "raw_sample": dict(list(raw_flags.items())[:8]),
+                    "true_flags": sorted(list(label_true_flags)),
+                })
+
+            score = len(wanted & label_true_flags)
+            if score <= 0:
+                continue
+
+            base = Path(file).stem
+            exts_found = [base + ext for ext in IMAGE_EXTS if (clothes_dir / (base + ext)).exists()]
+            if not exts_found:
+                out["missing_images"].append(base)
+                continue
+            yield (_rank_key(score, base, shuffle_ties), score, base, exts_found[0], sorted(label_true_flags))
+
+    top = heapq.nsmallest(k, scored(), key=lambda x: x[0])
+    out["candidates"] = [
+        {"score": s, "tie": key[1], "file_base": b, "chosen_file": c, "label_flags": fl}
+        for key, s, b, c, fl in top
+    ]
+    return out
+
+
+def _match_remote(url: str, wanted: List[str], k: int, shuffle_ties: bool,
+                  deadline: float, margin: float) -> Dict:
+    # Clocks differ between nodes, so the node gets the remaining budget rather
+    # than the deadline, less the margin it needs to send its answer back.
+    remaining = deadline - time.time()
+    payload = {"wanted": wanted, "k": k, "shuffle_ties": shuffle_ties,
+               "timeout": max(0.0, remaining - margin)}
+    resp = requests.post(url.rstrip("/") + "/shard/match", json=payload, timeout=max(0.001, remaining))
+    resp.raise_for_status()
+    res = resp.json()
+    for c in res.get("candidates", []):
+        c["chosen_file"] = f"{url.rstrip('/')}/static/{c['chosen_file']}"
+    return res
+
+
+def _warm_worker():
+    return os.getpid()
+
+
+def start_shard_pools():
+    """Creates (or recreates for new SHARD_SPECS) the shard worker pools.
+
+    Local shards run in "spawn" processes: forking a server that already has
+    torch and its threads loaded can deadlock. Workers are started here, not
+    on the first request, so that start-up never counts against a deadline.
+    """
+    global _PROCESS_POOL, _THREAD_POOL, _POOL_SPECS
+    with _POOL_LOCK:
+        specs = tuple(SHARD_SPECS)
+        if _POOL_SPECS == specs:
+            return _PROCESS_POOL, _THREAD_POOL
+        _shutdown_pools()
+        n_local = sum(1 for s in specs if not _is_remote(s))
+        n_remote = len(specs) - n_local
+        if n_local:
+            workers = n_local * SHARD_MAX_INFLIGHT
+            _PROCESS_POOL = ProcessPoolExecutor(max_workers=workers,
+                                                mp_context=multiprocessing.get_context("spawn"))
+            wait([_PROCESS_POOL.submit(_warm_worker) for _ in range(workers)])
+        if n_remote:
+            _THREAD_POOL = ThreadPoolExecutor(max_workers=n_remote * SHARD_MAX_INFLIGHT)
+        _POOL_SPECS = specs
+        return _PROCESS_POOL, _THREAD_POOL
+
+
+def _shutdown_pools():
+    global _PROCESS_POOL, _THREAD_POOL, _POOL_SPECS
+    for pool in (_PROCESS_POOL, _THREAD_POOL):
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+    _PROCESS_POOL = _THREAD_POOL = _POOL_SPECS = None
+    _INFLIGHT.clear()
+
+
+def shutdown_shard_pools():
+    with _POOL_LOCK:
+        _shutdown_pools()
+
+
+def _release(name: str):
+    def done(_fut):
+        with _POOL_LOCK:
+            _INFLIGHT[name] = max(0, _INFLIGHT.get(name, 1) - 1)
+    return done
+
+
+def _static_path(clothes_dir: Path, root: Path) -> Optional[str]:
+    # Path of clothes_dir relative to the /static root, or None if it is outside it.
+    try:
+        rel = clothes_dir.resolve().relative_to(root.resolve())
+    except ValueError:
+        return None
+    return PurePosixPath(*rel.parts).as_posix() if rel.parts else ""
+
+
+def find_matching_items_sharded(tags: Dict[str, bool], clothes_dir: Path,
+                                max_results: int = 5, shuffle_ties: bool = True,
+                                timeout: Optional[float] = None) -> Tuple[List[str], Dict]:
+    """Scatter-gather counterpart of predictor.find_matching_items.
+
+    Fans the wanted tags out to every shard in SHARD_SPECS, keeps whatever
+    top-k lists arrive before the timeout, and merges them into a global
+    top-k. Shards that time out, fail or are still busy with earlier calls
+    are reported in the debug dict and the result is marked partial.
+    clothes_dir is the root served under /static.
+    """
+    k = max_results or 5
+    timeout = SHARD_TIMEOUT if timeout is None else timeout
+    margin = min(SHARD_RETURN_MARGIN, timeout / 4)
+    wanted = sorted([kk for kk, v in tags.items() if v])
+    debug = {
+        "labels_checked": 0,
+        "matched_files": 0,
+        "missing_images": [],
+        "wanted": wanted,
+        "sample_label_flags": [],
+        "scored_candidates_sample": [],
+        "shards_total": len(SHARD_SPECS),
+        "shards_ok": [],
+        "shards_failed": [],
+        "shards_timed_out": [],
+        "partial": False,
+    }
+
+    process_pool, thread_pool = start_shard_pools()
+    clothes_root = Path(clothes_dir)
+    futures = {}
+    prefixes = {}
+    deadline = time.time() + timeout
+    for spec in SHARD_SPECS:
+        with _POOL_LOCK:
+            busy = _INFLIGHT.get(spec, 0) >= SHARD_MAX_INFLIGHT
+            if not busy:
+                _INFLIGHT[spec] = _INFLIGHT.get(spec, 0) + 1
+        if busy:
+            debug["shards_failed"].append({"shard": spec, "error": "busy: earlier calls still running"})
+            continue
+
+        if _is_remote(spec):
+            fut = thread_pool.submit(_match_remote, spec, wanted, k, shuffle_ties, deadline, margin)
+        else:
+            shard_labels, shard_clothes = parse_shard_spec(spec)
+            prefix = _static_path(shard_clothes, clothes_root)
+            if prefix is None:
+                _release(spec)(None)
+                debug["shards_failed"].append({"shard": spec, "error": f"{shard_clothes} is not inside {clothes_root}"})
+                continue
+            prefixes[spec] = prefix
+            fut = process_pool.submit(match_shard, str(shard_labels), str(shard_clothes),
+                                      wanted, k, shuffle_ties, deadline - margin)
+        fut.add_done_callback(_release(spec))
+        futures[fut] = spec
+
+    done, not_done = wait(futures, timeout=max(0.0, deadline - time.time()))
+    for fut in not_done:
+        # Only helps if the call has not started; running scans stop on their
+        # own deadline and the in-flight cap keeps them from piling up.
+        fut.cancel()
+        debug["shards_timed_out"].append(futures[fut])
+
+    candidates = []
+    for fut in done:
+        name = futures[fut]
+        try:
+            res = fut.result()
+        except Exception as e:
+            logger.warning("Shard %s failed: %s", name, e)
+            debug["shards_failed"].append({"shard": name, "error": str(e)})
+            continue
+        if res.get("error"):
+            debug["shards_failed"].append({"shard": name, "error": res["error"]})
+            continue
+        if res.get("timed_out"):
+            debug["shards_timed_out"].append(name)
+        else:
+            debug["shards_ok"].append(name)
+        debug["labels_checked"] += res.get("labels_checked", 0)
+        debug["missing_images"].extend(res.get("missing_images", []))
+        room = 12 - len(debug["sample_label_flags"])
+        debug["sample_label_flags"].extend(res.get("sample_label_flags", [])[:max(0, room)])
+        for c in res.get("candidates", []):
+            if name in prefixes and prefixes[name]:
+                c["chosen_file"] = f"{prefixes[name]}/{c['chosen_file']}"
+            c["shard"] = name
+            candidates.append(c)
+
+    debug["partial"] = bool(debug["shards_timed_out"] or debug["shards_failed"])
+    if debug["partial"]:
+        logger.warning("Partial match results: timed out=%s failed=%s",
+                       debug["shards_timed_out"], [f["shard"] for f in debug["shards_failed"]])
+
+    if not candidates:
+        debug["total_matches"] = 0
+        return [], debug
+
+    candidates.sort(key=lambda c: (-c["score"], c["tie"]))
+    results = []
+    seen_bases = set()
+    for c in candidates:
+        # Same item served by several shards (replicas, or mid-reshard) counts once.
+        if c["file_base"] in seen_bases:
+            continue
+        results.append(c["chosen_file"])
+        seen_bases.add(c["file_base"])
+        debug["scored_candidates_sample"].append({
+            "score": c["score"], "file_base": c["file_base"], "chosen_file": c["chosen_file"],
+            "label_flags": c["label_flags"], "shard": c["shard"],
+        })
+        if len(results) >= k:
+            break
+
+    if max_results and len(results) < max_results and clothes_root.exists():
+        # Same padding as the unsharded path, and only when matches run short.
+        pool = [i for i in os.listdir(clothes_root)
+                if i.lower().endswith(IMAGE_EXTS) and i not in results]
+        random.shuffle(pool)
+        while len(results) < max_results and pool:
+            results.append(pool.pop())
+
+    debug["total_matches"] = len(results)
+    debug["matched_files"] = len(results)
+    return results, debug
@@ -17,6 +17,8 @@ import numpy as np
 import torch
 import torch.nn.functional as F
 from transformers import CLIPProcessor, CLIPModel
+
+from models.catalog_shards import IMAGE_EXTS, truthy, sharding_enabled, find_matching_items_sharded
 BASE_DIR = Path(os.environ.get("FITCHECK_BASE", r"C:\Users\HP\oofa"))
 CLOTHES_DIR = Path(os.environ.get("FITCHECK_CLOTHES", BASE_DIR / "Clothes"))
 LABELS_DIR = Path(os.environ.get("FITCHECK_LABELS", CLOTHES_DIR / "labels"))
@@ -291,18 +293,11 @@ def detect_image_tags_clip(image_path: str, allowed_keys: List[str], threshold:
     debug = {"scores": per_key_scores, "top_scores": top_scores}
     return results, debug
 
-def _truthy(v):
-    if isinstance(v, bool):
-        return v
-    if v is None:
-        return False
-    if isinstance(v, (int, float)):
-        return bool(v)
-    s = str(v).strip().lower()
-    return s in ("true", "1", "yes", "y", "t")
-
 def find_matching_items(tags: Dict[str, bool], max_results: int = 5, shuffle_ties: bool = True) -> Tuple[List[str], Dict]:
 
+    if sharding_enabled():
+        return find_matching_items_sharded(tags, CLOTHES_DIR, max_results=max_results, shuffle_ties=shuffle_ties)
+
     matches = []
     debug = {
         "labels_checked": 0,
@@ -333,7 +328,7 @@ def find_matching_items(tags: Dict[str, bool], max_results: int = 5, shuffle_tie
             continue
 
         raw_flags = data.get("flags", {}) if isinstance(data, dict) else {}
-        label_true_flags = {k for k, v in raw_flags.items() if _truthy(v)}
+        label_true_flags = {k for k, v in raw_flags.items() if truthy(v)}
 
         if len(debug["sample_label_flags"]) < 12:
             sample_raw = dict(list(raw_flags.items())[:8])
@@ -348,7 +343,7 @@ def find_matching_items(tags: Dict[str, bool], max_results: int = 5, shuffle_tie
         if score > 0:
             base = Path(file).stem
             exts_found = []
-            for ext in (".webp", ".png", ".jpg", ".jpeg"):
+            for ext in IMAGE_EXTS:
                 candidate = CLOTHES_DIR / (base + ext)
                 if candidate.exists():
                     exts_found.append(base + ext)
@@ -361,7 +356,7 @@ def find_matching_items(tags: Dict[str, bool], max_results: int = 5, shuffle_tie
         debug["total_matches"] = 0
         return [], debug
 
-    scored.sort(key=lambda x: x[0], reverse=True)
+    scored.sort(key=lambda x: (-x[0], x[1]))
     if shuffle_ties:
         grouped = {}
         for sc in scored:
@@ -390,7 +385,7 @@ def find_matching_items(tags: Dict[str, bool], max_results: int = 5, shuffle_tie
     if max_results and len(results) < max_results:
         all_images = []
         for img in os.listdir(CLOTHES_DIR):
-            if img.lower().endswith((".webp", ".png", ".jpg", ".jpeg")):
+            if img.lower().endswith(IMAGE_EXTS):
                 all_images.append(img)
         pool = [i for i in all_images if i not in results]
         random.shuffle(pool)
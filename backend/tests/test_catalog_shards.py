@@ -0,0 +1,142 @@
+import json
+
+import pytest
+
+from models import catalog_shards
+
+ITEMS = {
+    "a": {"jeans": True, "blue": True, "casual": True},
+    "b": {"jeans": True, "blue": True},
+    "c": {"jeans": True, "casual": "yes"},
+    "d": {"blue": True},
+    "e": {"casual": True},
+    "f": {"casual": True, "red": True},
+    "g": {"red": True},
+    "h": {"jeans": True, "blue": True, "casual": True, "denim": True},
+    "i": {"casual": True, "blue": False},
+}
+
+
+def _write_item(clothes_dir, base, flags):
+    (clothes_dir / "labels").mkdir(parents=True, exist_ok=True)
+    (clothes_dir / "labels" / f"{base}.json").write_text(json.dumps({"flags": flags}), encoding="utf-8")
+    (clothes_dir / f"{base}.jpg").write_bytes(b"")
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    root = tmp_path / "Clothes"
+    shard_dirs = [root / "shards" / str(i) for i in range(3)]
+    for n, (base, flags) in enumerate(sorted(ITEMS.items())):
+        _write_item(root / "all", base, flags)
+        _write_item(shard_dirs[n % 3], base, flags)
+    yield root, [str(d / "labels") for d in shard_dirs], str(root / "all" / "labels")
+    catalog_shards.shutdown_shard_pools()
+
+
+def _run(monkeypatch, root, specs, tags, **kwargs):
+    monkeypatch.setattr(catalog_shards, "SHARD_SPECS", list(specs))
+    return catalog_shards.find_matching_items_sharded(tags, root, **kwargs)
+
+
+def _names(results):
+    return [r.rsplit("/", 1)[-1] for r in results]
+
+
+def test_merged_top_k_matches_unsharded(monkeypatch, catalog):
+    root, shards, single = catalog
+    tags = {"jeans": True, "blue": True, "casual": True, "red": False}
+    sharded, debug = _run(monkeypatch, root, shards, tags, max_results=4, shuffle_ties=False, timeout=30)
+    unsharded, _ = _run(monkeypatch, root, [single], tags, max_results=4, shuffle_ties=False, timeout=30)
+
+    assert _names(sharded) == _names(unsharded) == ["a.jpg", "h.jpg", "b.jpg", "c.jpg"]
+    assert sharded[0] == "shards/0/a.jpg"
+    assert debug["labels_checked"] == len(ITEMS)
+    assert not debug["partial"]
+    assert debug["sample_label_flags"]
+
+
+def test_shuffle_ties_false_is_deterministic(monkeypatch, catalog):
+    root, shards, _ = catalog
+    runs = [_run(monkeypatch, root, shards, {"casual": True}, max_results=1, shuffle_ties=False, timeout=30)[0]
+            for _ in range(3)]
+    assert runs == [["shards/0/a.jpg"]] * 3
+
+
+def test_no_matches_returns_empty(monkeypatch, catalog):
+    root, shards, _ = catalog
+    results, debug = _run(monkeypatch, root, shards, {"nonexistent": True}, timeout=30)
+    assert results == []
+    assert debug["total_matches"] == 0
+
+
+def test_timeout_returns_partial(monkeypatch, catalog):
+    root, shards, _ = catalog
+    results, debug = _run(monkeypatch, root, shards, {"jeans": True}, timeout=0)
+    assert debug["partial"]
+    assert sorted(debug["shards_timed_out"]) == sorted(shards)
+    assert debug["shards_ok"] == []
+
+
+def test_slow_shard_returns_partial_top_k(monkeypatch, tmp_path):
+    root = tmp_path / "Clothes"
+    slow = root / "slow"
+    (slow / "labels").mkdir(parents=True)
+    for i in range(20000):
+        (slow / "labels" / f"{i}.json").write_text('{"flags": {"jeans": true}}', encoding="utf-8")
+        if i % 10 == 0:
+            (slow / f"{i}.jpg").write_bytes(b"")
+    try:
+        results, debug = _run(monkeypatch, root, [str(slow / "labels")], {"jeans": True},
+                              max_results=3, timeout=0.3)
+    finally:
+        catalog_shards.shutdown_shard_pools()
+
+    assert debug["shards_timed_out"] == [str(slow / "labels")]
+    assert debug["partial"]
+    assert 0 < debug["labels_checked"] < 20000
+    assert len(results) == 3
+    assert all(r.startswith("slow/") for r in results)
+
+
+def test_same_item_in_two_shards_counts_once(monkeypatch, tmp_path):
+    root = tmp_path / "Clothes"
+    for shard in ("a", "b"):
+        _write_item(root / shard, "dup", {"jeans": True, "blue": True})
+    _write_item(root / "b", "other", {"jeans": True})
+    try:
+        results, _ = _run(monkeypatch, root, [str(root / "a" / "labels"), str(root / "b" / "labels")],
+                          {"jeans": True, "blue": True}, max_results=2, shuffle_ties=False, timeout=30)
+    finally:
+        catalog_shards.shutdown_shard_pools()
+    assert _names(results) == ["dup.jpg", "other.jpg"]
+
+
+def test_failed_shard_is_reported(monkeypatch, catalog, tmp_path):
+    root, shards, _ = catalog
+    missing = str(root / "missing" / "labels")
+    results, debug = _run(monkeypatch, root, shards + [missing], {"jeans": True}, max_results=2,
+                          shuffle_ties=False, timeout=30)
+    assert [f["shard"] for f in debug["shards_failed"]] == [missing]
+    assert missing not in debug["shards_ok"]
+    assert sorted(debug["shards_ok"]) == sorted(shards)
+    assert debug["partial"]
+    assert results == ["shards/0/a.jpg", "shards/1/b.jpg"]
+
+
+def test_remote_matches_are_absolute_urls(monkeypatch, catalog):
+    root, _, _ = catalog
+
+    class Resp:
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return {"candidates": [{"score": 2, "tie": "x", "file_base": "x", "chosen_file": "x.jpg",
+                                    "label_flags": ["blue", "jeans"]}]}
+
+    monkeypatch.setattr(catalog_shards.requests, "post", lambda *a, **kw: Resp())
+    results, debug = _run(monkeypatch, root, ["http://node-1:8000/"], {"jeans": True, "blue": True},
+                          max_results=1, shuffle_ties=False, timeout=30)
+    assert results == ["http://node-1:8000/static/x.jpg"]
+    assert debug["shards_ok"] == ["http://node-1:8000/"]
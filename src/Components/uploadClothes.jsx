@@ -239,7 +239,7 @@ export default function UploadClothes({ displayName }) {
                   {/* ⭐ NEW HORIZONTAL SCROLL WRAPPER ⭐ */}
                   <div style={pageStyles.horizontalScroll}>
                     {matches.map((imgPath, idx) => {
-                      const src = `http://127.0.0.1:8000/static/${imgPath}`;
+                      const src = /^https?:\/\//.test(imgPath) ? imgPath : `http://127.0.0.1:8000/static/${imgPath}`;
                       const isHover = hoverIdx === idx;
                       return (
                         <div